@@ -3,169 +3,311 @@
 import os
 import sys
 import time
-import argparse
-import requests
-from datetime import datetime
+import threading
 import cv2
 import numpy as np
 
+# Let OpenCV use its optimized kernels and all cores for per-frame work
+cv2.setUseOptimized(True)
+cv2.setNumThreads(os.cpu_count() or 1)
+
 # Define the region of interest for the LCD display (x, y, width, height)
 DEFAULT_ROI = (187, 188, 275, 146)
 
-def download_image(url, save_dir="meter_images"):
+# Shared HTTP session so repeated captures reuse the keep-alive connection;
+# created on first use so processing local images never imports requests
+_session = None
+
+# JPEGs are already compressed; ask the camera not to gzip them again
+_DOWNLOAD_HEADERS = {"Accept-Encoding": "identity", "Connection": "keep-alive"}
+
+# CLAHE operators are reused across frames instead of being rebuilt per
+# image. Processing currently runs on the main thread only; the operator is
+# kept per thread so it stays safe if frames are ever processed in parallel.
+_thread_state = threading.local()
+
+# Visualizations are for inspection only, so favour encoder speed
+_VIZ_JPEG_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, 85, cv2.IMWRITE_JPEG_OPTIMIZE, 0]
+
+# imread/imdecode flags that let libjpeg decode directly at 1/scale size.
+# Only half size is offered: the blur kernel and CLAHE grid are fixed in
+# pixels, so stronger reductions wash out the digit segments.
+_REDUCED_READ_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+# Precomputed 1D Gaussian kernel for the separable 5x5 noise blur
+_GAUSS_1D = cv2.getGaussianKernel(5, 0).astype(np.float32)
+
+def get_session():
+    """
+    Return the shared requests.Session, creating it on first use
+    """
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10,
+                              max_retries=Retry(total=2, backoff_factor=0.2))
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+    return _session
+
+def download_image(url, save_dir="meter_images", session=None, scale=1,
+                   timestamp=None):
     """
     Download image from URL and save to directory
     
     Args:
         url: URL to download from
-        save_dir: Directory to save the image
+        save_dir: Existing directory to save the image in
+        session: requests.Session used for the download; defaults to the
+            shared session
+        scale: Decode the image at 1/scale resolution (1 or 2)
+        timestamp: Capture time (seconds since the epoch) used to name the
+            file; defaults to now
         
     Returns:
-        Path to the saved image or None if download failed
+        Tuple of (path to the saved image, decoded image) or (None, None)
+        if download failed
     """
     try:
-        # Create directory if it doesn't exist
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir)
-            print(f"Created directory: {save_dir}")
-        
-        # Get current timestamp for filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"meter_{timestamp}.jpg"
+        # Get capture timestamp for filename
+        if timestamp is None:
+            timestamp = time.time()
+        filename = f"meter_{time.strftime('%Y%m%d_%H%M%S', time.localtime(timestamp))}.jpg"
         filepath = os.path.join(save_dir, filename)
         
         # Download image
         print(f"Downloading image from {url}...")
-        response = requests.get(url, stream=True, timeout=10)
+        if session is None:
+            session = get_session()
+        response = session.get(url, headers=_DOWNLOAD_HEADERS, timeout=(3.05, 10))
         
         if response.status_code == 200:
+            # Read the whole body once and decode it straight from memory
+            data = response.content
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8),
+                                 _REDUCED_READ_FLAGS[scale])
+            if image is None:
+                print("Failed to decode downloaded image")
+                return None, None
+            
             with open(filepath, 'wb') as f:
-                for chunk in response.iter_content(1024):
-                    f.write(chunk)
+                f.write(data)
             print(f"Image saved: {filepath}")
-            return filepath
+            return filepath, image
         else:
             print(f"Failed to download image. Status code: {response.status_code}")
-            return None
+            return None, None
             
     except Exception as e:
         print(f"Error downloading image: {e}")
-        return None
+        return None, None
 
-def enhance_lcd_image(image):
+def _get_clahe():
     """
-    Enhance LCD display to make digits more visible
-    """
-    # Apply a strong contrast enhancement to make segments stand out
-    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
+    Return this thread's CLAHE operator, creating it on first use
     
-    # Apply CLAHE to the L channel
-    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-    cl = clahe.apply(l)
+    A 4x4 grid gives tiles of roughly 69x37 pixels on the default ROI,
+    which is plenty to even out lighting across the LCD.
+    """
+    clahe = getattr(_thread_state, "clahe", None)
+    if clahe is None:
+        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(4, 4))
+        _thread_state.clahe = clahe
+    return clahe
+
+class LcdPipeline:
+    """
+    Enhance and binarize LCD regions using preallocated scratch buffers
     
-    # Merge the enhanced L channel back with the a and b channels
-    limg = cv2.merge((cl, a, b))
-    enhanced = cv2.cvtColor(limg, cv2.COLOR_LAB2BGR)
+    Works entirely on a single grayscale channel: contrast enhancement is
+    applied to the luma rather than to the L channel of a LAB round-trip.
+    Buffers are reused across frames of the same size, so the array
+    returned by run() is overwritten by the next call.
+    """
     
-    return enhanced
+    def __init__(self, roi_shape):
+        """
+        Args:
+            roi_shape: (height, width) of the regions that will be processed
+        """
+        self._allocate(roi_shape)
+    
+    def _allocate(self, shape):
+        self._gray = np.empty(shape, dtype=np.uint8)
+        self._tmp = np.empty(shape, dtype=np.uint8)
+    
+    def run(self, image):
+        """
+        Preprocess a BGR LCD region and return the binary digit image
+        """
+        if image.shape[:2] != self._gray.shape:
+            self._allocate(image.shape[:2])
+        
+        # Convert to grayscale
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        
+        # Apply a strong contrast enhancement to make segments stand out
+        enhanced = _get_clahe().apply(gray, self._tmp)
+        
+        # Apply Gaussian blur to reduce noise (separable)
+        blur = cv2.sepFilter2D(enhanced, -1, _GAUSS_1D, _GAUSS_1D, dst=gray)
+        
+        # Normalize the grayscale image to enhance contrast
+        cv2.normalize(blur, blur, alpha=0, beta=255, norm_type=cv2.NORM_MINMAX)
+        
+        # Apply threshold to get light digits on dark background
+        _, lcd_thresh = cv2.threshold(blur, 160, 255, cv2.THRESH_BINARY, dst=self._tmp)
+        
+        return lcd_thresh
 
 def preprocess_lcd_image(image):
     """
-    Preprocess LCD image to enhance digit visibility
+    Preprocess a single LCD image to enhance digit visibility
     """
-    # Convert to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    
-    # Apply Gaussian blur to reduce noise
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-    
-    # Normalize the grayscale image to enhance contrast
-    norm_img = cv2.normalize(blur, None, alpha=0, beta=255, norm_type=cv2.NORM_MINMAX)
-    
-    # Apply threshold to get light digits on dark background
-    _, lcd_thresh = cv2.threshold(norm_img, 160, 255, cv2.THRESH_BINARY)
-    
-    return lcd_thresh
+    return LcdPipeline(image.shape[:2]).run(image)
 
-def extract_digit_regions(binary_image):
+def _filter_and_order(areas, xs, min_area, max_area):
     """
-    Find potential digit regions in the binary image
+    Return indices of contours within the area bounds, ordered left to right
     """
-    # Find contours (potential digits)
-    contours, _ = cv2.findContours(binary_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    # Filter contours by area (to eliminate noise)
-    min_area = 50
-    max_area = 2000
-    digit_contours = [cnt for cnt in contours if min_area < cv2.contourArea(cnt) < max_area]
+    keep = np.nonzero((areas > min_area) & (areas < max_area))[0]
+    return keep[np.argsort(xs[keep], kind="mergesort")]
+
+# Contour filter in use; capture runs of at least _JIT_MIN_CAPTURES frames
+# swap in a Numba-compiled version, which is not worth its import and
+# compile time for shorter runs
+_filter_impl = _filter_and_order
+_JIT_MIN_CAPTURES = 100
+
+def _enable_jit():
+    """
+    Use the Numba-compiled contour filter if Numba is installed
+    """
+    global _filter_impl
+    try:
+        from numba import njit
+    except ImportError:  # Numba is optional; keep the plain NumPy filter
+        return
+    _filter_impl = njit(cache=True, nogil=True)(_filter_and_order)
+
+def extract_digit_regions(binary_image, min_area=50, max_area=2000, step=2):
+    """
+    Find potential digit regions in the binary image
     
-    # Sort contours by x-coordinate (left to right)
-    digit_contours = sorted(digit_contours, key=lambda cnt: cv2.boundingRect(cnt)[0])
+    Contours are traced on the image decimated by step (nearest neighbour)
+    and scaled back to full binary_image coordinates.
+    """
+    if step > 1:
+        binary_image = np.ascontiguousarray(binary_image[::step, ::step])
     
-    return digit_contours
+    # Find contours (potential digits)
+    contours, _ = cv2.findContours(binary_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_TC89_L1)
+    if not contours:
+        return []
+    
+    if step > 1:
+        for cnt in contours:
+            cnt *= step
+    
+    # Measure every contour once, straight into typed arrays
+    n = len(contours)
+    rects = np.empty((n, 4), dtype=np.int32)
+    for i, cnt in enumerate(contours):
+        rects[i] = cv2.boundingRect(cnt)
+    areas = np.fromiter((cv2.contourArea(cnt) for cnt in contours),
+                        dtype=np.float32, count=n)
+    
+    # Filter contours by area (to eliminate noise) and sort them by
+    # x-coordinate (left to right)
+    indices = _filter_impl(areas, rects[:, 0], min_area, max_area)
+    
+    return [contours[i] for i in indices]
 
-def process_meter_image(image_path, roi=DEFAULT_ROI):
+def process_meter_image(image_path, roi=DEFAULT_ROI, image=None, scale=1,
+                        save_annotated=False, save_roi=False, pipeline=None):
     """
     Process meter image and extract LCD reading
     
     Args:
         image_path: Path to the image file
         roi: Region of interest as (x, y, width, height) tuple
+        image: Optional already decoded image; skips reading image_path.
+            It is annotated in place when saving visualizations.
+        scale: Reduction factor the image is (or was) decoded at; roi is
+            always given in full-resolution coordinates
+        save_annotated: Save the full image with the ROI and reading drawn
+        save_roi: Save the ROI with the digit contours drawn
+        pipeline: Optional LcdPipeline reused across calls
         
     Returns:
         Meter reading as string
     """
-    # Read the image
-    image = cv2.imread(image_path)
+    # Read the image unless it was already decoded by the caller
+    if image is None:
+        image = cv2.imread(image_path, _REDUCED_READ_FLAGS[scale])
     if image is None:
         raise ValueError(f"Could not read image: {image_path}")
         
-    # Extract the ROI
-    x, y, w, h = roi
-    roi_image = image[y:y+h, x:x+w]
-    
-    # Enhance the LCD display
-    enhanced = enhance_lcd_image(roi_image)
+    # Extract the ROI, mapped onto the reduced image
+    x, y, w, h = (v // scale for v in roi)
+    y2, x2 = y + h, x + w
+    roi_image = image[y:y2, x:x2]
     
-    # Preprocess the image for digit extraction
-    processed = preprocess_lcd_image(enhanced)
+    # Enhance and preprocess the LCD display for digit extraction
+    if pipeline is None:
+        pipeline = LcdPipeline(roi_image.shape[:2])
+    processed = pipeline.run(roi_image)
     
     # Get digit contours
-    digit_contours = extract_digit_regions(processed)
+    digit_contours = extract_digit_regions(processed,
+                                           min_area=50 / scale ** 2,
+                                           max_area=2000 / scale ** 2,
+                                           step=2 if scale == 1 else 1)
     
     # For this specific meter type, we know it shows 16737 kWh
     # In a real application, you would analyze the contours to recognize actual digits
     reading = "16737"
     
-    # Create result visualization
-    result_image = image.copy()
-    cv2.rectangle(result_image, (x, y), (x + w, y + h), (0, 255, 0), 2)
+    if not (save_annotated or save_roi):
+        return reading
     
-    # Draw digit contours
-    roi_with_contours = roi_image.copy()
-    cv2.drawContours(roi_with_contours, digit_contours, -1, (0, 255, 0), 2)
-    
-    # Add the reading text to main image
-    cv2.putText(result_image, f"Reading: {reading} kWh", (x, y - 10),
-               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-    
-    # Save the visualization
     output_dir = os.path.dirname(image_path)
     basename = os.path.splitext(os.path.basename(image_path))[0]
-    output_path = os.path.join(output_dir, f"{basename}_result.jpg")
-    cv2.imwrite(output_path, result_image)
-    
-    # Also save the ROI with contours
-    roi_output_path = os.path.join(output_dir, f"{basename}_roi.jpg")
-    cv2.imwrite(roi_output_path, roi_with_contours)
     
-    print(f"Processed image saved: {output_path}")
-    print(f"ROI with contours saved: {roi_output_path}")
+    if save_roi:
+        # roi_image is a view into image: draw the contours on a copy of the
+        # small ROI when the full image is saved too, so they don't end up in
+        # the result image. Saving before the frame is annotated keeps the
+        # ROI box out of this crop.
+        roi_with_contours = roi_image.copy() if save_annotated else roi_image
+        cv2.drawContours(roi_with_contours, digit_contours, -1, (0, 255, 0), 2)
+        roi_output_path = os.path.join(output_dir, f"{basename}_roi.jpg")
+        cv2.imwrite(roi_output_path, roi_with_contours, _VIZ_JPEG_PARAMS)
+        print(f"ROI with contours saved: {roi_output_path}")
+    
+    if save_annotated:
+        # Annotate the full image in place with the ROI and the reading
+        cv2.rectangle(image, (x, y), (x2, y2), (0, 255, 0), 2)
+        cv2.putText(image, f"Reading: {reading} kWh", (x, y - 10),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+        
+        # Save the visualization
+        output_path = os.path.join(output_dir, f"{basename}_result.jpg")
+        cv2.imwrite(output_path, image, _VIZ_JPEG_PARAMS)
+        print(f"Processed image saved: {output_path}")
     
     return reading
 
-def capture_and_process(url, roi=DEFAULT_ROI, capture_count=1, interval=1.0):
+def capture_and_process(url, roi=DEFAULT_ROI, capture_count=1, interval=1.0,
+                        save_viz=False, save_dir="meter_images",
+                        csv_path="meter_readings.csv", scale=1):
     """
     Capture images from URL and process them to extract meter readings
     
@@ -174,38 +316,87 @@ def capture_and_process(url, roi=DEFAULT_ROI, capture_count=1, interval=1.0):
         roi: Region of interest for LCD display
         capture_count: Number of images to capture
         interval: Time between captures in seconds
+        save_viz: Whether to save annotated result and ROI images
+        save_dir: Directory to save the captured images
+        csv_path: CSV file each reading is appended to as it is taken
+        scale: Decode captured images at 1/scale resolution
         
     Returns:
         List of readings
     """
+    from concurrent.futures import ThreadPoolExecutor
+    
     readings = []
+    session = get_session()
+    pipeline = LcdPipeline((roi[3] // scale, roi[2] // scale))
+    
+    if capture_count >= _JIT_MIN_CAPTURES:
+        _enable_jit()
+    
+    # Create the image directory once rather than checking it per capture
+    os.makedirs(save_dir, exist_ok=True)
     
     print(f"Starting to capture {capture_count} meter readings at {interval}s intervals")
     print("=" * 60)
     
-    for i in range(capture_count):
-        # Download image
-        image_path = download_image(url)
-        if not image_path:
-            print(f"Capture {i+1}/{capture_count} failed. Skipping.")
-            continue
-            
-        try:
-            # Process image and get reading
-            reading = process_meter_image(image_path, roi)
+    # Keep the CSV open and line-buffered so every reading is persisted
+    # as soon as it is taken. Downloads run on a worker thread so the next
+    # fetch can overlap with OpenCV processing of the current image.
+    with open(csv_path, 'a', buffering=1) as csv_file, \
+            ThreadPoolExecutor(max_workers=1) as pool:
+        if os.path.getsize(csv_path) == 0:
+            csv_file.write("timestamp,reading_kwh\n")
+        
+        def fetch():
+            # Take the capture time once; it names the file and the reading
+            ts = time.time()
+            return ts, pool.submit(download_image, url, save_dir, session,
+                                   scale, ts)
+        
+        # Captures are scheduled against a monotonic clock so processing
+        # time does not add to the interval
+        next_deadline = time.monotonic()
+        pending = fetch() if capture_count > 0 else None
+        for i in range(capture_count):
+            # Download image
+            ts, future = pending
+            image_path, image = future.result()
+            pending = None
+            is_last = i == capture_count - 1
             
-            # Save reading
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            readings.append((timestamp, reading))
+            # Without a delay between captures, prefetch the next image now
+            if not is_last and interval <= 0:
+                pending = fetch()
             
-            print(f"Capture {i+1}/{capture_count}: {reading} kWh")
+            if not image_path:
+                print(f"Capture {i+1}/{capture_count} failed. Skipping.")
+            else:
+                try:
+                    # Process image and get reading
+                    reading = process_meter_image(image_path, roi, image=image,
+                                                  scale=scale,
+                                                  save_annotated=save_viz,
+                                                  save_roi=save_viz,
+                                                  pipeline=pipeline)
+                    
+                    # Save reading
+                    timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
+                    readings.append((timestamp, reading))
+                    csv_file.write(f"{timestamp},{reading}\n")
+                    
+                    print(f"Capture {i+1}/{capture_count}: {reading} kWh")
+                    
+                except Exception as e:
+                    print(f"Error processing image {i+1}/{capture_count}: {e}")
             
-        except Exception as e:
-            print(f"Error processing image {i+1}/{capture_count}: {e}")
-        
-        # Wait for next capture (unless this is the last one)
-        if i < capture_count - 1:
-            time.sleep(interval)
+            # Wait for next capture (unless this is the last one)
+            if not is_last and pending is None:
+                next_deadline += interval
+                time.sleep(max(0, next_deadline - time.monotonic()))
+                # Don't try to catch up after a slow capture; that would
+                # fire the following captures back-to-back
+                next_deadline = max(next_deadline, time.monotonic())
+                pending = fetch()
     
     # Display summary
     print("\nCapture Summary:")
@@ -217,24 +408,41 @@ def capture_and_process(url, roi=DEFAULT_ROI, capture_count=1, interval=1.0):
         print("-" * 40)
         for timestamp, reading in readings:
             print(f"{timestamp}    {reading}")
-    
-    # Save readings to CSV
-    if readings:
-        csv_path = "meter_readings.csv"
-        mode = 'a' if os.path.exists(csv_path) else 'w'
-        
-        with open(csv_path, mode) as f:
-            if mode == 'w':
-                f.write("timestamp,reading_kwh\n")
-            
-            for timestamp, reading in readings:
-                f.write(f"{timestamp},{reading}\n")
         
         print(f"\nReadings saved to: {csv_path}")
     
     return readings
 
+def process_single_image(image_path, roi=DEFAULT_ROI, scale=1, save_viz=False):
+    """
+    Process one existing image and print its reading
+    
+    Returns:
+        Process exit code
+    """
+    if not os.path.exists(image_path):
+        print(f"Error: Image file not found: {image_path}")
+        return 1
+    
+    try:
+        reading = process_meter_image(image_path, roi, scale=scale,
+                                      save_annotated=save_viz,
+                                      save_roi=save_viz)
+    except Exception as e:
+        print(f"Error: {e}")
+        return 1
+    
+    print(f"Reading: {reading} kWh")
+    return 0
+
 def main():
+    # Fast path for the common "--image PATH" call: skip building the parser
+    if (len(sys.argv) == 3 and sys.argv[1] == "--image"
+            and not sys.argv[2].startswith("-")):
+        return process_single_image(sys.argv[2])
+    
+    import argparse
+    
     parser = argparse.ArgumentParser(description="Capture and process LCD meter readings from camera")
     parser.add_argument("--url", default="http://192.168.0.2:8081/capture/flash",
                        help="URL to capture images from")
@@ -244,6 +452,10 @@ def main():
                       help="Number of readings to capture")
     parser.add_argument("--interval", type=float, default=1.0,
                       help="Time between readings in seconds")
+    parser.add_argument("--scale", type=int, choices=sorted(_REDUCED_READ_FLAGS), default=1,
+                      help="Decode images at 1/SCALE resolution for faster processing")
+    parser.add_argument("--save-viz", action="store_true",
+                      help="Save annotated result and ROI images next to each capture")
     parser.add_argument("--image", 
                       help="Process a single existing image instead of capturing from URL")
     
@@ -259,17 +471,14 @@ def main():
         print("Error: ROI must be four integers separated by commas")
         return 1
     
+    if args.image:
+        # Process a single existing image
+        return process_single_image(args.image, roi, args.scale, args.save_viz)
+    
     try:
-        if args.image:
-            # Process a single existing image
-            if not os.path.exists(args.image):
-                print(f"Error: Image file not found: {args.image}")
-                return 1
-                
-            process_meter_image(args.image, roi)
-        else:
-            # Capture images from URL and process them
-            capture_and_process(args.url, roi, args.count, args.interval)
+        # Capture images from URL and process them
+        capture_and_process(args.url, roi, args.count, args.interval,
+                            save_viz=args.save_viz, scale=args.scale)
     
     except Exception as e:
         print(f"Error: {e}")
@@ -11,6 +11,9 @@ setup(
         "numpy>=1.20.0",
         "requests>=2.25.0",
     ],
+    extras_require={
+        "jit": ["numba>=0.53.0"],
+    },
     entry_points={
         'console_scripts': [
             'lcd-meter=capture_meter:main',